@@ -0,0 +1,39 @@
+"""Cascade thread deletes to participants, agents and messages
+
+Revision ID: 7f3a9c1d2e4b
+Revises: 2c521edcb357
+Create Date: 2026-10-14 15:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f3a9c1d2e4b'
+down_revision: Union[str, None] = '2c521edcb357'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Tables whose thread_id foreign key follows the thread on delete
+CHILD_TABLES = ('thread_participants', 'thread_agents', 'messages')
+
+
+def upgrade() -> None:
+    for table in CHILD_TABLES:
+        op.drop_constraint(f'{table}_thread_id_fkey', table, type_='foreignkey')
+        op.create_foreign_key(
+            f'{table}_thread_id_fkey', table, 'threads',
+            ['thread_id'], ['id'], ondelete='CASCADE'
+        )
+
+
+def downgrade() -> None:
+    for table in CHILD_TABLES:
+        op.drop_constraint(f'{table}_thread_id_fkey', table, type_='foreignkey')
+        op.create_foreign_key(
+            f'{table}_thread_id_fkey', table, 'threads',
+            ['thread_id'], ['id']
+        )
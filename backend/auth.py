@@ -1,4 +1,3 @@
-from datetime import datetime, timedelta
 from typing import Optional, Dict
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -8,6 +7,7 @@ from sqlalchemy import select
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr, constr
 import os
+import time
 
 from models import User 
 
@@ -44,8 +44,8 @@ class AuthManager:
         
     def create_access_token(self, data: Dict) -> str:
         to_encode = data.copy()
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
+        # An integer NumericDate is what the claim encodes to anyway
+        to_encode["exp"] = int(time.time()) + ACCESS_TOKEN_EXPIRE_MINUTES * 60
         return jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
         
     async def authenticate_user(self, db: AsyncSession, username: str, password: str):
@@ -1,10 +1,10 @@
 # message_persistence.py
-from sqlalchemy import select, and_, desc, func, text
+from sqlalchemy import select, insert, and_, or_, desc, func, literal, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import aliased, joinedload
 from typing import List, Optional, Dict, Any
 from datetime import datetime
-from uuid import UUID
+from uuid import UUID, uuid4
 import logging
 from fastapi import HTTPException
 
@@ -21,7 +21,9 @@ class MessagePersistenceManager:
         Save a message to the database with all associated metadata.
         """
         try:
+            now = datetime.utcnow()
             message = Message(
+                id=uuid4(),
                 thread_id=message_data['thread_id'],
                 user_id=message_data.get('user_id'),
                 agent_id=message_data.get('agent_id'),
@@ -30,22 +32,22 @@ class MessagePersistenceManager:
                 parent_id=message_data.get('parent_id'),
                 edited=False,
                 deleted=False,
-                created_at=datetime.utcnow(),
+                created_at=now,
                 client_generated_id=message_data.get('client_generated_id')
             )
-            
             self.db.add(message)
+
+            # A new message has no receipts yet, so the sender's receipt is
+            # flushed alongside it instead of going through create_read_receipt
+            if message.user_id:
+                self.db.add(MessageReadReceipt(
+                    message_id=message.id,
+                    user_id=message.user_id,
+                    read_at=now
+                ))
+
             await self.db.commit()
             await self.db.refresh(message)
-            
-            # Create message read receipt for sender
-            if message.user_id:
-                await self.create_read_receipt(
-                    message.id,
-                    message.user_id,
-                    datetime.utcnow()
-                )
-            
             return message
         except Exception as e:
             await self.db.rollback()
@@ -146,19 +148,21 @@ class MessagePersistenceManager:
             if message.user_id != editor_id:
                 raise HTTPException(status_code=403, detail="Not authorized to edit this message")
 
+            now = datetime.utcnow()
+
             # Store original content in metadata
             if not message.message_metadata.get('edit_history'):
                 message.message_metadata['edit_history'] = []
             
             message.message_metadata['edit_history'].append({
                 'content': message.content,
-                'edited_at': datetime.utcnow().isoformat(),
+                'edited_at': now.isoformat(),
                 'edited_by': str(editor_id)
             })
 
             message.content = new_content
             message.edited = True
-            message.edited_at = datetime.utcnow()
+            message.edited_at = now
 
             await self.db.commit()
             await self.db.refresh(message)
@@ -272,31 +276,31 @@ class MessagePersistenceManager:
         Get count of unread messages in a thread for a user.
         """
         try:
-            # Get the timestamp of the user's last read message in the thread
-            last_read = await self.db.execute(
+            # Timestamp of the user's last read message in the thread, folded
+            # into the count below so both are answered in one round-trip
+            read_message = aliased(Message)
+            last_read = (
                 select(func.max(MessageReadReceipt.read_at))
-                .join(Message, Message.id == MessageReadReceipt.message_id)
+                .join(read_message, read_message.id == MessageReadReceipt.message_id)
                 .where(
                     and_(
-                        Message.thread_id == thread_id,
+                        read_message.thread_id == thread_id,
                         MessageReadReceipt.user_id == user_id
                     )
                 )
+                .scalar_subquery()
             )
-            last_read_time = last_read.scalar()
 
             # Count messages after the last read timestamp
             query = select(func.count(Message.id)).where(
                 and_(
                     Message.thread_id == thread_id,
                     Message.user_id != user_id,
-                    Message.deleted == False
+                    Message.deleted == False,
+                    or_(last_read.is_(None), Message.created_at > last_read)
                 )
             )
 
-            if last_read_time:
-                query = query.where(Message.created_at > last_read_time)
-
             result = await self.db.execute(query)
             return result.scalar()
         except Exception as e:
@@ -311,9 +315,15 @@ class MessagePersistenceManager:
         Mark all messages in a thread as read for a user.
         """
         try:
-            # Get all unread messages
-            messages = await self.db.execute(
-                select(Message)
+            # Insert a receipt for every unread message in one statement
+            now = datetime.utcnow()
+            unread = (
+                select(
+                    func.gen_random_uuid(),
+                    Message.id,
+                    literal(user_id, MessageReadReceipt.user_id.type),
+                    literal(now, MessageReadReceipt.read_at.type)
+                )
                 .where(
                     and_(
                         Message.thread_id == thread_id,
@@ -330,16 +340,11 @@ class MessagePersistenceManager:
                 )
                 .where(MessageReadReceipt.id == None)
             )
-
-            # Create read receipts
-            now = datetime.utcnow()
-            for message in messages.scalars():
-                receipt = MessageReadReceipt(
-                    message_id=message.id,
-                    user_id=user_id,
-                    read_at=now
+            await self.db.execute(
+                insert(MessageReadReceipt).from_select(
+                    ["id", "message_id", "user_id", "read_at"], unread
                 )
-                self.db.add(receipt)
+            )
 
             await self.db.commit()
         except Exception as e:
@@ -144,24 +144,25 @@ async def send_message(
     current_user = Depends(auth_manager.get_current_user)
 ):
     # Verify thread participation
-    if not await db.is_thread_participant(thread_id, current_user.id):
+    if not await db_manager.is_thread_participant(db, thread_id, current_user.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not a thread participant"
         )
 
     # Create user message
-    message = await db.create_message(
+    message = await db_manager.create_message(
+        db,
         thread_id=thread_id,
         user_id=current_user.id,
         content=content
     )
 
     # Get thread agents and generate their responses
-    thread_agents = await db.get_thread_agents(thread_id)
-    thread_context = await db.get_thread_context(thread_id)
+    thread_agents = await db_manager.get_thread_agents(db, thread_id)
+    thread_context = await db_manager.get_thread_context(db, thread_id)
 
-    agent_responses = []
+    responses = []
     for agent in thread_agents:
         if agent.is_active:
             response = await agent_manager.get_response(
@@ -169,14 +170,16 @@ async def send_message(
                 message=content,
                 thread_context=thread_context
             )
-            
-            agent_message = await db.create_message(
-                thread_id=thread_id,
-                agent_id=agent.id,
-                content=response.content,
-                metadata=response.metadata
-            )
-            agent_responses.append(agent_message)
+            responses.append((agent.id, response.content, response.metadata))
+
+    # Store every agent's reply with a single INSERT
+    agent_responses = []
+    if responses:
+        agent_responses = await db_manager.create_agent_messages(
+            db,
+            thread_id=thread_id,
+            responses=responses
+        )
 
     return {
         "user_message": message,
@@ -1,12 +1,16 @@
 from fastapi import Request, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from datetime import datetime, timedelta, UTC
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Deque, Tuple
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
+from itertools import islice
 import jwt
+import hashlib
 import logging
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -20,24 +24,51 @@ class RateLimitExceeded(HTTPException):
     def __init__(self, detail: str = "Rate limit exceeded"):
         super().__init__(status_code=429, detail=detail)
 
+# How long an IP stays blocked after too many failed attempts
+BLOCK_SECONDS = 15 * 60
+
+# Most (ip, path) pairs tracked for rate limiting; a flood of new clients
+# evicts idle pairs first, then the least recently used, instead of growing
+# the cache without bound
+RATE_LIMIT_CACHE_SIZE = 10_000
+# Least recently used pairs checked for idleness when the cache is full;
+# bounded so a flood of live clients doesn't make every insert O(N)
+RATE_LIMIT_EVICTION_SCAN = 64
+
+@lru_cache(maxsize=128)
+def _parse_limit(limit: str) -> int:
+    """Return the request count from an "X/timeunit" limit string."""
+    return int(limit.split('/')[0])
+
+def _client_key(request: Request) -> Tuple[str, str]:
+    """Return (client host, path), read from the ASGI scope when there is one."""
+    # request.client and request.url build Address/URL objects per request
+    scope = getattr(request, "scope", None)
+    # Anything but a real scope (e.g. a test double) falls back to the properties
+    if type(scope) is dict:
+        return scope["client"][0], scope["path"]
+    return request.client.host, request.url.path
+
 class SecurityManager:
     def __init__(self):
-        self.api_key_cache: Dict[str, List[datetime]] = {}  # Changed to store list of timestamps
+        # Monotonic request times per (ip, path), oldest first; the pairs
+        # themselves are kept least recently used first
+        self.api_key_cache: OrderedDict[Tuple[str, str], Deque[float]] = OrderedDict()
         self.failed_attempts: Dict[str, int] = {}
-        self.blocked_ips: Dict[str, datetime] = {}
+        # Monotonic time at which each IP's block ends
+        self.blocked_ips: Dict[str, float] = {}
 
     async def cleanup(self):
         """Remove expired entries from caches."""
-        current_time = datetime.now(UTC)
+        current_time = time.monotonic()
         
-        # Clean api_key_cache - remove old timestamps
-        for key in list(self.api_key_cache.keys()):
-            self.api_key_cache[key] = [
-                ts for ts in self.api_key_cache[key]
-                if (current_time - ts).total_seconds() < 3600
-            ]
-            if not self.api_key_cache[key]:
-                del self.api_key_cache[key]
+        # Clean api_key_cache - a key is stale once its newest request is;
+        # older times on live keys are trimmed by the next rate-limit check
+        cutoff = current_time - 3600
+        self.api_key_cache = OrderedDict(
+            (k, v) for k, v in self.api_key_cache.items()
+            if v and v[-1] > cutoff
+        )
         
         # Clean blocked_ips
         self.blocked_ips = {
@@ -54,34 +85,56 @@ class SecurityManager:
             limit: String in format "X/timeunit" (e.g. "5/second")
             duration: Time window in seconds
         """
-        client_ip = request.client.host
-        cache_key = f"{client_ip}:{request.url.path}"
-        current_time = datetime.now(UTC)
-        max_requests = int(limit.split('/')[0])
-
-        # Initialize timestamps list if not exists
-        if cache_key not in self.api_key_cache:
-            self.api_key_cache[cache_key] = []
+        await self._check_rate_limit(
+            *_client_key(request),
+            _parse_limit(limit),
+            duration
+        )
+
+    async def _check_rate_limit(self, client_ip: str, path: str, max_requests: int, duration: int):
+        """Check and record a request against an already-parsed limit."""
+        cache_key = (client_ip, path)
+        current_time = time.monotonic()
+
+        cutoff = current_time - duration
+        timestamps = self.api_key_cache.get(cache_key)
+        if timestamps is None:
+            if len(self.api_key_cache) >= RATE_LIMIT_CACHE_SIZE:
+                self._evict_rate_limit_key(cutoff)
+            timestamps = self.api_key_cache[cache_key] = deque()
+        else:
+            # Every hit counts as use, rejected or not, so a client that keeps
+            # knocking can't be churned out of the cache by other keys
+            self.api_key_cache.move_to_end(cache_key)
         
-        # Clean old timestamps
-        self.api_key_cache[cache_key] = [
-            ts for ts in self.api_key_cache[cache_key]
-            if (current_time - ts).total_seconds() < duration
-        ]
+        # Times are appended in order, so the expired ones are all at the front
+        while timestamps and timestamps[0] <= cutoff:
+            timestamps.popleft()
         
         # Check if limit exceeded
-        if len(self.api_key_cache[cache_key]) >= max_requests:
+        if len(timestamps) >= max_requests:
             raise RateLimitExceeded()
         
         # Record this request
-        self.api_key_cache[cache_key].append(current_time)
+        timestamps.append(current_time)
+
+    def _evict_rate_limit_key(self, cutoff: float):
+        """Drop idle keys near the LRU end, or else the least recently used one."""
+        idle = [
+            key for key, timestamps in islice(self.api_key_cache.items(), RATE_LIMIT_EVICTION_SCAN)
+            if not timestamps or timestamps[-1] <= cutoff
+        ]
+        for key in idle:
+            del self.api_key_cache[key]
+        if not idle:
+            self.api_key_cache.popitem(last=False)
 
     async def check_blocked_ip(self, request: Request):
         """Check if IP is blocked."""
         client_ip = request.client.host
-        current_time = datetime.now(UTC)
-        if client_ip in self.blocked_ips:
-            if current_time < self.blocked_ips[client_ip]:
+        blocked_until = self.blocked_ips.get(client_ip)
+        if blocked_until is not None:
+            if time.monotonic() < blocked_until:
                 raise HTTPException(
                     status_code=403,
                     detail="IP address is blocked"
@@ -95,12 +148,23 @@ class SecurityManager:
         self.failed_attempts[client_ip] = self.failed_attempts.get(client_ip, 0) + 1
         
         if self.failed_attempts[client_ip] >= 5:
-            self.blocked_ips[client_ip] = datetime.now(UTC) + timedelta(minutes=15)
+            self.block_ip_for(client_ip, BLOCK_SECONDS)
             del self.failed_attempts[client_ip]
 
+    def block_ip_for(self, client_ip: str, seconds: float):
+        """Block an IP for the given number of seconds from now."""
+        self.blocked_ips[client_ip] = time.monotonic() + seconds
+
+# Decoded tokens are reused for at most this long, and never past their "exp"
+TOKEN_CACHE_TTL = 3600
+TOKEN_CACHE_SIZE = 10_000
+
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
+        # sha256(token) -> (expires_at, payload), oldest first
+        self._token_cache: Dict[bytes, tuple] = {}
+        self._decode = partial(jwt.decode, key=JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
 
     async def __call__(self, request: Request):
         auth_header = request.headers.get("Authorization")
@@ -124,12 +188,17 @@ class JWTBearer(HTTPBearer):
                 detail="Invalid authentication credentials"
             )
             
+        cache_key = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        cached = self._token_cache.get(cache_key)
+        if cached is not None:
+            if cached[0] > now:
+                # A copy, so a handler that edits its payload can't poison the cache
+                return dict(cached[1])
+            del self._token_cache[cache_key]
+
         try:
-            payload = jwt.decode(
-                token,
-                JWT_SECRET_KEY,
-                algorithms=[JWT_ALGORITHM]
-            )
+            payload = self._decode(token)
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=401,
@@ -140,15 +209,27 @@ class JWTBearer(HTTPBearer):
                 status_code=403,
                 detail="Invalid token"
             )
-            
-        return payload
+
+        # Only successful validations are cached
+        if len(self._token_cache) >= TOKEN_CACHE_SIZE:
+            del self._token_cache[next(iter(self._token_cache))]
+        self._token_cache[cache_key] = (
+            min(payload.get("exp", now + TOKEN_CACHE_TTL), now + TOKEN_CACHE_TTL),
+            payload
+        )
+        return dict(payload)
 
 # Rate limit decorators
 def rate_limit(limit: str, duration: int):
     """Rate limit decorator."""
+    # Parse the limit once here rather than on every request
+    max_requests = _parse_limit(limit)
+
     def decorator(func):
+        check = security_manager._check_rate_limit
+
         async def wrapper(request: Request, *args, **kwargs):
-            await security_manager.check_rate_limit(request, limit, duration)
+            await check(*_client_key(request), max_requests, duration)
             return await func(request=request, *args, **kwargs)
         return wrapper
     return decorator
@@ -54,6 +54,7 @@ async def startup():
         #await db_manager.create_tables()
         # Start cleanup task as a background process
         asyncio.create_task(initialize_connection_manager())
+        logger.info(f"Event loop: {type(asyncio.get_running_loop()).__module__}")
         logger.info("Application startup complete")
     except Exception as e:
         logger.error(f"Startup error: {str(e)}", exc_info=True)
@@ -1,17 +1,22 @@
 import os
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import pytest
 import asyncio
+import itertools
+import contextlib
 import asyncpg
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+try:
+    import uvloop
+except ImportError:  # uvloop is optional; fall back to the stdlib loop
+    uvloop = None
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
+from sqlalchemy import text, event
 
 from uuid import uuid4
 from datetime import datetime, UTC
 from models import Base, User, Thread, ThreadParticipant, UserRole, ThreadStatus
+from database import DatabaseManager
 
 
 # Database configuration
@@ -21,6 +26,27 @@ DB_USER = os.getenv('TEST_DB_USER', 'postgres')
 DB_PASS = os.getenv('TEST_DB_PASS', 'postgres')
 DB_NAME = os.getenv('TEST_DB_NAME', 'cyberiad_test')
 
+# Shared test data templates
+EMAIL = "{}@example.com".format
+HASHED_PASSWORD = "hashed_password"
+
+# Wipes committed rows without rebuilding the schema
+TRUNCATE_ALL = text(
+    "TRUNCATE {} RESTART IDENTITY CASCADE".format(
+        ", ".join(table.name for table in Base.metadata.sorted_tables)
+    )
+)
+
+# Connections opened by test_engine before the first test runs; the pool
+# keeps this many open and allows as many again under concurrent load
+WARM_CONNECTIONS = 4
+
+# Under pytest-xdist each worker gets its own database so workers never
+# contend for the same tables.
+XDIST_WORKER = os.getenv('PYTEST_XDIST_WORKER')
+if XDIST_WORKER:
+    DB_NAME = f"{DB_NAME}_{XDIST_WORKER}"
+
 POSTGRES_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/postgres"
 TEST_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
@@ -29,8 +55,7 @@ async def reliability_reset():
     """Reset database state for reliability tests."""
     async def _reset():
         async with engine.begin() as conn:
-            await conn.run_sync(Base.metadata.drop_all)
-            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(TRUNCATE_ALL)
     return _reset()
 
 @pytest.fixture
@@ -62,29 +87,67 @@ async def create_test_database():
         print(f"Error creating database: {e}")
         raise
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 async def test_engine():
-    """Create test engine instance."""
-    return engine
+    """Share one test engine across the whole session.
+
+    A few connections are opened up front so the first test doesn't pay
+    for the handshake and dialect initialisation.
+    """
+    # A sync QueuePool here would block the event loop on checkout
+    assert isinstance(engine.pool, AsyncAdaptedQueuePool)
+    async with asyncio.TaskGroup() as tg:
+        tasks = [
+            tg.create_task(engine.connect().start())
+            for _ in range(WARM_CONNECTIONS)
+        ]
+    for task in tasks:
+        await task.result().close()
+    yield engine
+    await engine.dispose()
 
 @pytest.fixture
 async def reset_db(test_engine):
     """Reset database state between tests."""
     async with test_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(TRUNCATE_ALL)
     return True  # Return a simple value instead of the engine
 
 @pytest.fixture
-async def test_thread(test_db_session):
+def count_queries(test_engine):
+    """Return a context manager that records the SQL run inside it."""
+    @contextlib.contextmanager
+    def _count():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(test_engine.sync_engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(test_engine.sync_engine, "before_cursor_execute", record)
+    return _count
+
+# Session-wide counter behind the uniq fixture
+_ids = itertools.count()
+
+@pytest.fixture(scope="session")
+def uniq():
+    """Return a factory for short, unique, reproducible names."""
+    return lambda prefix: f"{prefix}_{next(_ids):06d}"
+
+@pytest.fixture
+async def test_thread(test_db_session, uniq):
     """Create a test thread with owner for testing."""
     async with test_db_session as session:
         # Create a test user
         test_user = User(
             id=uuid4(),
-            username=f"testuser_{uuid4().hex[:8]}",
-            email=f"test_{uuid4().hex[:8]}@example.com",
-            hashed_password="test_password",
+            username=uniq("testuser"),
+            email=EMAIL(uniq("test")),
+            hashed_password=HASHED_PASSWORD,
             role=UserRole.USER,
             created_at=datetime.now(UTC)
         )
@@ -118,25 +181,34 @@ async def test_thread(test_db_session):
 async def setup_tables():
     """Create all tables in the test database."""
     print("Creating tables...")  # Debug print
-    engine = create_async_engine(TEST_DATABASE_URL, echo=True)
+    engine = create_async_engine(TEST_DATABASE_URL, echo=False, poolclass=NullPool)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     await engine.dispose()
     print("Tables created successfully")  # Debug print
 
-@pytest.fixture(scope="session")
-def event_loop():
-    """Create an instance of the default event loop for the test session."""
-    policy = asyncio.get_event_loop_policy()
-    loop = policy.new_event_loop()
-    yield loop
-    loop.close()
+if uvloop is not None:
+    def pytest_asyncio_loop_factories(config, item):
+        """Run async tests and fixtures on uvloop's libuv-based event loop."""
+        return {"uvloop": uvloop.new_event_loop}
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--sql-debug",
+        action="store_true",
+        help="Log every SQL statement the test engine runs"
+    )
 
 def pytest_configure(config):
     """Run database setup when pytest starts."""
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(create_test_database())
-    loop.run_until_complete(setup_tables())
+    # Statement logging stays off unless asked for; it formats every query
+    engine.echo = config.getoption("--sql-debug")
+
+    async def setup():
+        await create_test_database()
+        await setup_tables()
+
+    asyncio.run(setup())
 
 def pytest_unconfigure(config):
     """Clean up database when pytest exits."""
@@ -156,16 +228,46 @@ def pytest_unconfigure(config):
             print(f"Error dropping database: {e}")
             raise
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(cleanup())
+    asyncio.run(cleanup())
+
+# Create engine for sessions. Every test runs on the session-scoped event
+# loop, so pooled connections can be reused from one test to the next.
+# Test data need not survive a crash, so commits don't wait for the WAL flush.
+engine = create_async_engine(
+    TEST_DATABASE_URL,
+    echo=False,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=WARM_CONNECTIONS,
+    max_overflow=WARM_CONNECTIONS,
+    connect_args={"server_settings": {"synchronous_commit": "off"}}
+)
 
-# Create engine for sessions
-engine = create_async_engine(TEST_DATABASE_URL, echo=True)
+# Sessions join the per-test outer transaction through a SAVEPOINT
+TestSession = async_sessionmaker(
+    expire_on_commit=False,
+    join_transaction_mode="create_savepoint"
+)
 
 @pytest.fixture
-async def test_db_session():
-    """Create test session."""
-    TestSession = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    async with TestSession() as session:
-        yield session
-        await session.rollback()
+async def test_db_session(test_engine):
+    """Create a test session inside an outer transaction.
+
+    Commits made by the code under test only release a SAVEPOINT; the outer
+    transaction is rolled back on teardown, so every test starts from the
+    schema created once in pytest_configure.
+    """
+    async with test_engine.connect() as conn:
+        trans = await conn.begin()
+        session = TestSession(bind=conn)
+        try:
+            yield session
+        finally:
+            await session.close()
+            await trans.rollback()
+
+@pytest.fixture(scope="module")
+def db_manager():
+    """Share one DatabaseManager per test module."""
+    manager = DatabaseManager()
+    yield manager
+    manager._active_connections.clear()
@@ -1,34 +1,7 @@
-import os
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent.parent))
-
 import pytest
 from unittest.mock import Mock, patch
-from datetime import datetime, UTC
-from jose import jwt
 
 from agent_system import AgentSystem, AgentRole, AGENTS
-from auth import AuthManager, JWT_SECRET_KEY, JWT_ALGORITHM
-
-@pytest.fixture
-def auth_manager():
-    return AuthManager()
-
-@pytest.mark.asyncio
-async def test_create_access_token(auth_manager):
-    """Test JWT token creation"""
-    data = {"sub": "testuser"}
-    token = auth_manager.create_access_token(data)
-    
-    # Verify token
-    decoded = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-    assert decoded["sub"] == "testuser"
-    assert "exp" in decoded
-
-    # Ensure expiration is in the future
-    exp = datetime.fromtimestamp(decoded["exp"], UTC)
-    assert exp > datetime.now(UTC)
 
 @pytest.mark.asyncio
 async def test_agent_roles_enum():
@@ -1,4 +1,5 @@
 # tests/test_auth.py
+import os
 import pytest
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -7,15 +8,12 @@ from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from fastapi.security import OAuth2PasswordBearer
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import ValidationError 
-from unittest.mock import patch
 from fastapi import HTTPException
 from jose import jwt, JWTError
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent.parent))
 from models import User, UserRole
-from .conftest import test_db_session
+from .conftest import test_db_session, EMAIL
 from auth import (
     AuthManager, 
     JWT_SECRET_KEY, 
@@ -25,23 +23,28 @@ from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
+# Finalise the Pydantic schemas at import so the first validation test
+# doesn't pay for it.
+Token.model_rebuild()
+UserAuth.model_rebuild()
+
 @pytest.fixture
 def auth_manager():
     return AuthManager()
 
 @pytest.fixture
-async def test_user(test_db_session):
+async def test_user(test_db_session, uniq):
     async with test_db_session as session:
         auth_mgr = AuthManager()
         hashed_password = auth_mgr.get_password_hash("testpassword123")
         
-        # Use a random username to avoid conflicts
-        unique_username = f"testuser_{uuid.uuid4().hex[:8]}"
+        # Use a unique username to avoid conflicts
+        unique_username = uniq("testuser")
         
         # Use ORM instead of raw SQL
         user = User(
             username=unique_username,
-            email=f"{unique_username}@example.com",
+            email=EMAIL(unique_username),
             hashed_password=hashed_password,
             role=UserRole.USER
         )
@@ -50,8 +53,8 @@ async def test_user(test_db_session):
         await session.refresh(user)
         return user
 
-def test_password_hashing(auth_manager):
-    password = "mysecretpassword"
+@pytest.mark.parametrize("password", ["mysecretpassword", "test_password"])
+def test_password_hashing(auth_manager, password):
     hashed = auth_manager.get_password_hash(password)
     
     # Test that hash is different from original password
@@ -67,16 +70,18 @@ def test_password_hashing(auth_manager):
     hashed2 = auth_manager.get_password_hash(password)
     assert hashed != hashed2
 
-def test_create_access_token(auth_manager):
-    data = {"sub": "testuser", "additional": "data"}
+@pytest.mark.parametrize("data", [
+    {"sub": "testuser"},
+    {"sub": "testuser", "additional": "data"},
+])
+def test_create_access_token(auth_manager, data):
     token = auth_manager.create_access_token(data)
     
     # Decode and verify the token
     decoded = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
     
     # Check token contents
-    assert decoded["sub"] == "testuser"
-    assert decoded["additional"] == "data"
+    assert all(decoded[k] == v for k, v in data.items())
     assert "exp" in decoded
     
     # Check expiration time
@@ -97,7 +102,7 @@ def test_create_expired_token(auth_manager):
         jwt.decode(expired_token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
 
 @pytest.mark.asyncio
-async def test_authenticate_user(test_db_session: AsyncSession):
+async def test_authenticate_user(test_db_session: AsyncSession, monkeypatch):
     """Test user authentication with database."""
     async with test_db_session as session:
         auth_manager = AuthManager()
@@ -113,23 +118,23 @@ async def test_authenticate_user(test_db_session: AsyncSession):
         await session.commit()
 
         # Test valid credentials
-        with patch.object(auth_manager, 'verify_password', return_value=True):
-            authenticated_user = await auth_manager.authenticate_user(
-                session,
-                user.username,
-                "correct_password"
-            )
-            assert authenticated_user is not None
-            assert authenticated_user.username == user.username
+        monkeypatch.setattr(auth_manager, 'verify_password', lambda *args, **kwargs: True)
+        authenticated_user = await auth_manager.authenticate_user(
+            session,
+            user.username,
+            "correct_password"
+        )
+        assert authenticated_user is not None
+        assert authenticated_user.username == user.username
 
         # Test invalid credentials
-        with patch.object(auth_manager, 'verify_password', return_value=False):
-            non_authenticated_user = await auth_manager.authenticate_user(
-                session,
-                user.username,
-                "wrong_password"
-            )
-            assert non_authenticated_user is None
+        monkeypatch.setattr(auth_manager, 'verify_password', lambda *args, **kwargs: False)
+        non_authenticated_user = await auth_manager.authenticate_user(
+            session,
+            user.username,
+            "wrong_password"
+        )
+        assert non_authenticated_user is None
 
 @pytest.mark.asyncio
 async def test_get_current_user_valid_token(auth_manager, test_db_session, test_user):
@@ -251,47 +256,43 @@ def test_user_auth_model_validation():
             password="password123"
         )
 
-@pytest.mark.asyncio
-async def test_password_hashing_performance(auth_manager):
+def _timed_hash(auth_manager, password):
+    """Hash a password and return the elapsed seconds."""
+    start_time = time.perf_counter()  # More precise than time.time()
+    auth_manager.get_password_hash(password)
+    return time.perf_counter() - start_time
+
+@pytest.mark.performance
+def test_password_hashing_performance(auth_manager):
     """Test that password hashing has appropriate performance characteristics.
     
     The test ensures that:
     - Hashing is not too fast (which could indicate weak security)
     - Hashing is not too slow (which would affect usability)
-    - Hashing is consistent across multiple runs
+    
+    Hash correctness and salting are covered by test_password_hashing.
     """
     password = "test_password"
     NUM_SAMPLES = 3
     MIN_TIME = 0.05  # 50ms minimum
     MAX_TIME = 0.5   # 500ms maximum
     
-    # Test multiple samples to ensure consistent performance
-    times = []
-    hashes = []
-    
-    for _ in range(NUM_SAMPLES):
-        start_time = time.perf_counter()  # More precise than time.time()
-        hash_result = auth_manager.get_password_hash(password)
-        end_time = time.perf_counter()
-        
-        hashing_time = end_time - start_time
-        times.append(hashing_time)
-        hashes.append(hash_result)
+    # Test multiple samples to ensure consistent performance.
+    # bcrypt releases the GIL, so the samples can be hashed in parallel;
+    # never use more workers than cores or per-sample timings get inflated.
+    max_workers = min(NUM_SAMPLES, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_timed_hash, auth_manager, password)
+            for _ in range(NUM_SAMPLES)
+        ]
+        times = [future.result() for future in futures]
     
     avg_time = sum(times) / len(times)
     
     # Test performance bounds
     assert MIN_TIME < avg_time < MAX_TIME, \
         f"Hashing time ({avg_time:.3f}s) outside acceptable range ({MIN_TIME}-{MAX_TIME}s)"
-    
-    # Verify that each hash is different (due to random salt)
-    assert len(set(hashes)) == NUM_SAMPLES, \
-        "Multiple hashes of same password should be unique due to salt"
-    
-    # Verify that each hash can be verified
-    for hash_value in hashes:
-        assert auth_manager.verify_password(password, hash_value), \
-            "Hash verification failed"
 
 def test_oauth2_password_bearer():
     """Test OAuth2PasswordBearer configuration."""
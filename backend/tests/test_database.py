@@ -1,76 +1,52 @@
-import os
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent / "backend"))
-sys.path.append(str(Path(__file__).resolve().parent.parent))
-
 import pytest
-from unittest.mock import AsyncMock, Mock
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
-from sqlalchemy import select
-from database import DatabaseManager
-from models import User, Thread, ThreadParticipant, Message
-from fastapi import WebSocket
+from sqlalchemy import select, bindparam
+from models import User, Thread, ThreadParticipant, ThreadAgent, Message, AgentType, ThreadStatus
 import uuid
 from datetime import datetime, UTC
-from .conftest import test_db_session
+from .conftest import test_db_session, EMAIL, HASHED_PASSWORD
+
+_PARTICIPANT_STMT = select(ThreadParticipant).where(
+    ThreadParticipant.thread_id == bindparam("tid"),
+    ThreadParticipant.user_id == bindparam("uid")
+)
+
+@pytest.fixture
+async def user(test_db_session, db_manager, uniq):
+    """Create a user with a unique username."""
+    unique_username = uniq("testuser")
+    return await db_manager.create_user(
+        test_db_session,
+        username=unique_username,
+        email=EMAIL(unique_username),
+        hashed_password=HASHED_PASSWORD
+    )
 
 @pytest.mark.asyncio
-async def test_create_user(test_db_session):
+async def test_create_user(test_db_session, db_manager, user):
     """Test user creation and basic attributes."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        unique_username = f"testuser_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
-            session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="hashed_password"
-        )
-        
-        assert user.username == unique_username
-        assert user.email == f"{unique_username}@example.com"
-        assert user.hashed_password == "hashed_password"
+        assert user.username.startswith("testuser_")
+        assert user.email == EMAIL(user.username)
+        assert user.hashed_password == HASHED_PASSWORD
         assert isinstance(user.id, uuid.UUID)
         assert isinstance(user.created_at, datetime)
         assert user.is_active is True
 
 @pytest.mark.asyncio
-async def test_get_user_by_username(test_db_session):
+async def test_get_user_by_username(test_db_session, db_manager, user):
     """Test user retrieval by username."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        unique_username = f"findme_{uuid.uuid4().hex[:8]}"
-        
-        # Create test user
-        user = await db_manager.create_user(
-            session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password123"
-        )
-        
         # Test retrieval
-        found_user = await db_manager.get_user_by_username(session, unique_username)
+        found_user = await db_manager.get_user_by_username(session, user.username)
         assert found_user.id == user.id
-        assert found_user.username == unique_username
+        assert found_user.username == user.username
 
 @pytest.mark.asyncio
-async def test_create_thread(test_db_session):
+async def test_create_thread(test_db_session, db_manager, user):
     """Test thread creation with owner."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        
-        # Create owner
-        unique_username = f"owner_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
-            session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password"
-        )
-        
         # Create thread
         title = "Test Thread"
         description = "Test Description"
@@ -88,20 +64,9 @@ async def test_create_thread(test_db_session):
         assert isinstance(thread.created_at, datetime)
 
 @pytest.mark.asyncio
-async def test_get_thread(test_db_session):
+async def test_get_thread(test_db_session, db_manager, user):
     """Test thread retrieval."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        
-        # Create user and thread
-        unique_username = f"thread_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
-            session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password"
-        )
-        
         thread = await db_manager.create_thread(
             session,
             owner_id=user.id,
@@ -115,50 +80,41 @@ async def test_get_thread(test_db_session):
 
 
 @pytest.mark.asyncio
-async def test_get_user_threads(test_db_session):
+async def test_get_user_threads(test_db_session, db_manager, user):
     """Test retrieval of all user's threads."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        
-        # Create user
-        unique_username = f"multi_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
+        # Create multiple threads
+        threads = await db_manager.bulk_create_threads(
             session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password"
+            owner_id=user.id,
+            titles=[f"Thread {i}" for i in range(3)]
         )
         
-        # Create multiple threads
-        threads = []
-        for i in range(3):
-            thread = await db_manager.create_thread(
-                session,
-                owner_id=user.id,
-                title=f"Thread {i}"
-            )
-            threads.append(thread)
-        
         # Test retrieval
         user_threads = await db_manager.get_user_threads(session, user.id)
         assert len(user_threads) == 3
         assert all(t.owner_id == user.id for t in user_threads)
 
 @pytest.mark.asyncio
-async def test_thread_participant(test_db_session):
-    """Test thread participant operations."""
+async def test_copy_threads(test_db_session, db_manager, user):
+    """Test that COPY-loaded threads read back with their owner attached."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        
-        # Create user and thread
-        unique_username = f"participant_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
+        ids = await db_manager.copy_threads(
             session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password"
+            owner_id=user.id,
+            titles=[f"Thread {i}" for i in range(100)]
         )
-        
+        assert len(ids) == 100
+
+        user_threads = await db_manager.get_user_threads(session, user.id)
+        assert {t.id for t in user_threads} == set(ids)
+        assert all(t.status == ThreadStatus.ACTIVE for t in user_threads)
+        assert await db_manager.is_thread_participant(session, ids[0], user.id)
+
+@pytest.mark.asyncio
+async def test_thread_participant(test_db_session, db_manager, user):
+    """Test thread participant operations."""
+    async with test_db_session as session:
         thread = await db_manager.create_thread(
             session,
             owner_id=user.id,
@@ -172,13 +128,12 @@ async def test_thread_participant(test_db_session):
             user.id
         )
         assert is_participant is True
+        assert await db_manager.is_thread_participant(session, thread.id, uuid.uuid4()) is False
 
         # Test participant properties
         result = await session.execute(
-            select(ThreadParticipant).where(
-                ThreadParticipant.thread_id == thread.id,
-                ThreadParticipant.user_id == user.id
-            )
+            _PARTICIPANT_STMT,
+            {"tid": thread.id, "uid": user.id}
         )
         participant = result.scalar_one()
         assert participant.thread_id == thread.id
@@ -186,20 +141,32 @@ async def test_thread_participant(test_db_session):
         assert participant.is_active is True
 
 @pytest.mark.asyncio
-async def test_messages(test_db_session):
-    """Test message creation and retrieval."""
+async def test_add_thread_participants(test_db_session, db_manager, user, uniq):
+    """Test adding several participants in one call."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        
-        # Create user and thread
-        unique_username = f"messenger_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
+        thread = await db_manager.create_thread(
             session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password"
+            owner_id=user.id,
+            title="Group Thread"
         )
-        
+        members = []
+        for _ in range(3):
+            username = uniq("member")
+            members.append(await db_manager.create_user(
+                session,
+                username=username,
+                email=EMAIL(username),
+                hashed_password=HASHED_PASSWORD
+            ))
+        member_ids = [member.id for member in members]
+
+        added = await db_manager.add_thread_participants(session, thread.id, member_ids)
+        assert sorted(added) == sorted(member_ids)
+
+@pytest.mark.asyncio
+async def test_messages(test_db_session, db_manager, user):
+    """Test message creation and retrieval."""
+    async with test_db_session as session:
         thread = await db_manager.create_thread(
             session,
             owner_id=user.id,
@@ -207,15 +174,14 @@ async def test_messages(test_db_session):
         )
         
         # Create multiple messages
-        messages = []
-        for i in range(3):
-            message = await db_manager.create_message(
-                session,
-                thread_id=thread.id,
-                user_id=user.id,
-                content=f"Message {i}"
-            )
-            messages.append(message)
+        messages = await db_manager.bulk_create_messages(
+            session,
+            thread_id=thread.id,
+            contents=[f"Message {i}" for i in range(3)],
+            user_id=user.id
+        )
+        assert [m.content for m in messages] == [f"Message {i}" for i in range(3)]
+        assert all(isinstance(m.id, uuid.UUID) for m in messages)
             
         # Test retrieval
         thread_messages = await db_manager.get_thread_messages(
@@ -227,37 +193,71 @@ async def test_messages(test_db_session):
         assert all(m.thread_id == thread.id for m in thread_messages)
 
 @pytest.mark.asyncio
-async def test_websocket_management():
-    """Test WebSocket connection management."""
-    db_manager = DatabaseManager()
-    thread_id = uuid.uuid4()
-    user_id = uuid.uuid4()
-    mock_websocket = Mock(spec=WebSocket)
-    
-    # Add connection
-    await db_manager.add_active_connection(thread_id, user_id, mock_websocket)
-    assert thread_id in db_manager._active_connections
-    assert user_id in db_manager._active_connections[thread_id]
-    
-    # Remove connection
-    await db_manager.remove_active_connection(thread_id, user_id)
-    assert thread_id not in db_manager._active_connections
+async def test_create_agent_messages(test_db_session, db_manager, user):
+    """Test storing several agent responses in one call."""
+    async with test_db_session as session:
+        thread = await db_manager.create_thread(
+            session,
+            owner_id=user.id,
+            title="Agent Thread"
+        )
+        agents = [
+            ThreadAgent(thread_id=thread.id, agent_type=agent_type)
+            for agent_type in (AgentType.LAWYER, AgentType.ACCOUNTANT)
+        ]
+        session.add_all(agents)
+        await session.commit()
+
+        messages = await db_manager.create_agent_messages(
+            session,
+            thread_id=thread.id,
+            responses=[
+                (agents[0].id, "Legal view", {"confidence": 0.9}),
+                (agents[1].id, "Financial view", None)
+            ]
+        )
+        assert [m.agent_id for m in messages] == [agent.id for agent in agents]
+        assert [m.content for m in messages] == ["Legal view", "Financial view"]
+        assert [m.message_metadata for m in messages] == [{"confidence": 0.9}, {}]
+        assert all(m.user_id is None for m in messages)
 
 @pytest.mark.asyncio
-async def test_thread_context(test_db_session):
-    """Test thread context retrieval."""
+@pytest.mark.parametrize("n", [3, 1000])
+async def test_copy_messages(test_db_session, db_manager, user, n):
+    """Test that COPY-loaded messages read back like ORM-created ones."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        
-        # Create user and thread
-        unique_username = f"context_{uuid.uuid4().hex[:8]}"
-        user = await db_manager.create_user(
+        thread = await db_manager.create_thread(
             session,
-            username=unique_username,
-            email=f"{unique_username}@example.com",
-            hashed_password="password"
+            owner_id=user.id,
+            title="Copy Thread"
         )
-        
+
+        contents = [f"Message {i}" for i in range(n)]
+        ids = await db_manager.copy_messages(
+            session,
+            thread_id=thread.id,
+            contents=contents,
+            user_id=user.id
+        )
+        assert len(ids) == n
+
+        thread_messages = await db_manager.get_thread_messages(
+            session,
+            thread.id,
+            limit=n
+        )
+        assert [m.id for m in thread_messages] == ids[::-1]
+        assert all(m.thread_id == thread.id for m in thread_messages)
+        assert all(m.message_metadata == {} for m in thread_messages)
+        assert all(m.deleted is False for m in thread_messages)
+
+        context = await db_manager.get_thread_context(session, thread.id, limit=n)
+        assert context.split("\n") == contents[::-1]
+
+@pytest.mark.asyncio
+async def test_thread_context(test_db_session, db_manager, user, count_queries):
+    """Test thread context retrieval."""
+    async with test_db_session as session:
         thread = await db_manager.create_thread(
             session,
             owner_id=user.id,
@@ -266,63 +266,49 @@ async def test_thread_context(test_db_session):
         
         # Create messages
         messages = ["First message", "Second message", "Third message"]
-        for content in messages:
-            await db_manager.create_message(
-                session,
-                thread_id=thread.id,
-                user_id=user.id,
-                content=content
-            )
+        await db_manager.bulk_create_messages(
+            session,
+            thread_id=thread.id,
+            contents=messages,
+            user_id=user.id
+        )
         
-        # Get context
-        context = await db_manager.get_thread_context(session, thread.id, limit=3)
-        for message in messages:
-            assert message in context
+        # Get context with one SELECT and no user loading
+        with count_queries() as statements:
+            context = await db_manager.get_thread_context(session, thread.id, limit=3)
+        assert len([s for s in statements if s.startswith("SELECT")]) == 1
+        # Newest first, in the order the messages were created
+        assert context.split("\n") == messages[::-1]
 
 @pytest.mark.asyncio
-async def test_broadcast_to_thread():
-    """Test thread message broadcasting."""
-    db_manager = DatabaseManager()
-    thread_id = uuid.uuid4()
-    sender_id = uuid.uuid4()
-    receiver_id = uuid.uuid4()
-    
-    # Create mock websockets
-    sender_ws = AsyncMock(spec=WebSocket)
-    receiver_ws = AsyncMock(spec=WebSocket)
-    
-    # Add connections
-    await db_manager.add_active_connection(thread_id, sender_id, sender_ws)
-    await db_manager.add_active_connection(thread_id, receiver_id, receiver_ws)
-    
-    # Test broadcast
-    message = "Test broadcast"
-    await db_manager.broadcast_to_thread(thread_id, sender_id, message)
-    
-    # Verify receiver got message but sender didn't
-    receiver_ws.send_text.assert_called_once_with(message)
-    sender_ws.send_text.assert_not_called()
-
-@pytest.mark.asyncio
-async def test_error_handling(test_db_session):
+async def test_error_handling(test_db_session, db_manager, user, uniq):
     """Test database error handling."""
     async with test_db_session as session:
-        db_manager = DatabaseManager()
-        username = f"duplicate_{uuid.uuid4().hex[:8]}"
-        
-        # Create first user
-        await db_manager.create_user(
-            session,
-            username=username,
-            email=f"{username}@example.com",
-            hashed_password="password"
-        )
-        
+        # The failed insert rolls back and expires `user`, so read it first
+        username, email = user.username, user.email
+
         # Try to create duplicate user
         with pytest.raises(Exception):
             await db_manager.create_user(
                 session,
                 username=username,
-                email=f"{username}@example.com",
-                hashed_password="password"
+                email=email,
+                hashed_password=HASHED_PASSWORD
             )
+
+        # The skip variant reports the duplicate without raising
+        skipped_id = await db_manager.create_user_or_skip(
+            session,
+            username=username,
+            email=email,
+            hashed_password=HASHED_PASSWORD
+        )
+        assert skipped_id is None
+
+        new_id = await db_manager.create_user_or_skip(
+            session,
+            username=uniq("testuser"),
+            email=EMAIL(uniq("test")),
+            hashed_password=HASHED_PASSWORD
+        )
+        assert isinstance(new_id, uuid.UUID)
@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import select, func
+from models import MessageReadReceipt
+from message_persistence import MessagePersistenceManager
+from .conftest import test_db_session, EMAIL, HASHED_PASSWORD
+
+@pytest.fixture
+async def users(test_db_session, db_manager, uniq):
+    """Create a message author and a reader."""
+    created = []
+    for prefix in ("author", "reader"):
+        username = uniq(prefix)
+        created.append(await db_manager.create_user(
+            test_db_session,
+            username=username,
+            email=EMAIL(username),
+            hashed_password=HASHED_PASSWORD
+        ))
+    return created
+
+@pytest.fixture
+def message_manager(test_db_session):
+    """MessagePersistenceManager bound to the test's session."""
+    return MessagePersistenceManager(test_db_session)
+
+@pytest.mark.asyncio
+async def test_mark_thread_read(test_db_session, db_manager, message_manager, users):
+    """Test that every unread message gets exactly one receipt."""
+    author, reader = users
+    async with test_db_session as session:
+        thread = await db_manager.create_thread(
+            session,
+            owner_id=author.id,
+            title="Receipt Thread"
+        )
+        # Seed the unread messages with COPY; only the receipts are under test
+        await db_manager.copy_messages(
+            session,
+            thread_id=thread.id,
+            contents=[f"Message {i}" for i in range(100)],
+            user_id=author.id
+        )
+
+        assert await message_manager.get_unread_count(thread.id, reader.id) == 100
+
+        await message_manager.mark_thread_read(thread.id, reader.id)
+        assert await message_manager.get_unread_count(thread.id, reader.id) == 0
+
+        # Already-read messages are skipped on a second pass
+        await message_manager.mark_thread_read(thread.id, reader.id)
+        count = await session.scalar(
+            select(func.count()).where(MessageReadReceipt.user_id == reader.id)
+        )
+        assert count == 100
+
+        # Only messages newer than the last receipt count as unread
+        await db_manager.copy_messages(
+            session,
+            thread_id=thread.id,
+            contents=["Late 1", "Late 2"],
+            user_id=author.id
+        )
+        assert await message_manager.get_unread_count(thread.id, reader.id) == 2
+
+@pytest.mark.asyncio
+async def test_save_message(test_db_session, db_manager, message_manager, users):
+    """Test that saving a message also marks it read for the sender."""
+    author, reader = users
+    async with test_db_session as session:
+        thread = await db_manager.create_thread(
+            session,
+            owner_id=author.id,
+            title="Saved Thread"
+        )
+
+        message = await message_manager.save_message({
+            "thread_id": thread.id,
+            "user_id": author.id,
+            "content": "Hello"
+        })
+        assert message.content == "Hello"
+
+        receipt = await session.scalar(
+            select(MessageReadReceipt).where(MessageReadReceipt.message_id == message.id)
+        )
+        assert receipt.user_id == author.id
+        assert receipt.read_at == message.created_at
+        assert await message_manager.get_unread_count(thread.id, reader.id) == 1
@@ -1,41 +1,52 @@
-import os
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent.parent))
-
 import pytest
 import gc
 import asyncio
-import psutil
+import tracemalloc
 import weakref
 from datetime import datetime
 import uuid
 from fastapi import WebSocket
-from sqlalchemy import select, text
+from sqlalchemy import select, insert, func, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from models import User, Thread, Message, ThreadParticipant
 from database import DatabaseManager
 from websocket_manager import ConnectionManager
 from .conftest import test_db_session
 
-def get_process_memory():
-    """Get current process memory usage in MB."""
-    process = psutil.Process(os.getpid())
-    return process.memory_info().rss / 1024 / 1024
+_COUNT_CONNECTIONS = text("""
+    SELECT count(*)
+    FROM pg_stat_activity
+    WHERE datname = current_database()
+""")
+_SELECT_ONE = text("SELECT 1")
+_SELECT_SERIES = text("SELECT i FROM generate_series(1, 50) AS s(i)")
+
+@pytest.fixture
+def traced_memory_mb():
+    """Trace Python allocations for one test; returns a reader in MB.
+
+    Unlike RSS, traced memory isn't skewed by allocator arenas or by what
+    earlier tests left behind.
+    """
+    tracemalloc.start()
+    yield lambda: tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+
+async def settle():
+    """Collect garbage, then yield once so finalizer-scheduled callbacks run."""
+    gc.collect()
+    await asyncio.sleep(0)
 
 async def count_db_connections(session):
     """Count active database connections."""
-    result = await session.execute(
-        text("""
-        SELECT count(*) 
-        FROM pg_stat_activity 
-        WHERE datname = current_database()
-        """)
-    )
+    result = await session.execute(_COUNT_CONNECTIONS)
     return result.scalar()
 
 class MockWebSocket:
     """Mock WebSocket class for testing."""
+    # Hundreds of these are created per test; skip the per-instance __dict__
+    __slots__ = ("closed", "_accepted")
+
     def __init__(self):
         self.closed = False
         self._accepted = False
@@ -62,19 +73,23 @@ class MockConnectionManager(ConnectionManager):
                 del self.active_connections[thread_id]
 
 @pytest.mark.asyncio
-async def test_database_connection_leaks(test_db_session):
+async def test_database_connection_leaks(test_engine, test_db_session):
     """Test that database connections are properly closed."""
     async with test_db_session as session:
         initial_count = await count_db_connections(session)
         
-        # Perform multiple queries sequentially
-        for _ in range(50):
-            await session.execute(text("SELECT 1"))
-            await session.commit()
+        # Fetch 50 rows in one round trip
+        result = await session.execute(_SELECT_SERIES)
+        assert len(result.all()) == 50
+        await session.commit()
+
+        # Check connections in and out of the pool to churn it
+        for _ in range(5):
+            async with test_engine.connect() as conn:
+                await conn.execute(_SELECT_ONE)
         
         # Force garbage collection
-        gc.collect()
-        await asyncio.sleep(0.1)  # Allow connections to close
+        await settle()
         
         final_count = await count_db_connections(session)
         assert final_count <= initial_count + 1  # +1 for the counting query itself
@@ -102,87 +117,99 @@ async def test_websocket_connection_cleanup():
     assert len(connection_manager.active_connections) == 0, "Active connections not cleared"
 
 @pytest.mark.asyncio
-async def test_sequential_access(test_db_session):
+async def test_sequential_access(test_db_session, uniq):
     """Test database behavior with sequential operations."""
     async with test_db_session as session:
+        # One timestamp is enough for every row this test creates
+        now = datetime.now()
+
         # Create test user
         user = User(
-            username=f"sequential_test_{uuid.uuid4().hex}",
+            username=uniq("sequential_test"),
             email="sequential@test.com",
             hashed_password="test",
-            created_at=datetime.now()
+            created_at=now
         )
         session.add(user)
         await session.commit()
         user_id = user.id
 
-        # Create threads sequentially
-        thread_ids = []
-        for i in range(5):
-            thread = Thread(
-                title=f"Thread {uuid.uuid4().hex}",
+        # Create the threads, then all of their messages, one batch each
+        threads = [
+            Thread(
+                title=f"Thread {i}",
                 owner_id=user_id,
-                created_at=datetime.now()
+                created_at=now
             )
-            session.add(thread)
-            await session.commit()
-            thread_ids.append(thread.id)
+            for i in range(5)
+        ]
+        session.add_all(threads)
+        await session.commit()
+        thread_ids = [thread.id for thread in threads]
 
-        # Create messages sequentially
-        for thread_id in thread_ids:
-            for i in range(10):
-                message = Message(
-                    thread_id=thread_id,
-                    user_id=user_id,
-                    content=f"Message {i}",
-                    created_at=datetime.now()
-                )
-                session.add(message)
-                await session.commit()
+        await session.execute(insert(Message), [
+            {
+                "thread_id": thread_id,
+                "user_id": user_id,
+                "content": f"Message {i}",
+                "created_at": now
+            }
+            for thread_id in thread_ids
+            for i in range(10)
+        ])
+        await session.commit()
 
-            # Verify message count immediately after creation
-            result = await session.execute(
-                select(Message).where(Message.thread_id == thread_id)
-            )
-            messages = result.scalars().all()
-            assert len(messages) == 10, f"Thread {thread_id} has incorrect message count"
+        # Verify every thread's message count in one query
+        result = await session.execute(
+            select(Message.thread_id, func.count())
+            .where(Message.thread_id.in_(thread_ids))
+            .group_by(Message.thread_id)
+        )
+        counts = dict(result.all())
+        for thread_id in thread_ids:
+            assert counts.get(thread_id) == 10, f"Thread {thread_id} has incorrect message count"
 
 @pytest.mark.asyncio
-async def test_memory_growth(test_db_session):
+async def test_memory_growth(test_db_session, traced_memory_mb, uniq):
     """Test for memory leaks during database operations."""
-    initial_memory = get_process_memory()
-    peak_memory = initial_memory
+    initial_memory = traced_memory_mb()
     
     async with test_db_session as session:
-        # Perform multiple database operations sequentially
-        for i in range(100):
-            user = User(
-                username=f"user_{uuid.uuid4().hex}",
-                email=f"user_{i}@test.com",
-                hashed_password="test",
-                created_at=datetime.now()
-            )
-            session.add(user)
-            await session.flush()
-            await session.commit()
-            
-            current_memory = get_process_memory()
-            peak_memory = max(peak_memory, current_memory)
+        now = datetime.now()
+        prefix = uniq("memory")
+
+        # A Core-style bulk insert skips the identity map, so only real leaks
+        # show up as growth
+        await session.execute(insert(User), [
+            {
+                "username": f"{prefix}_{i}",
+                "email": f"user_{i}@test.com",
+                "hashed_password": "test",
+                "created_at": now
+            }
+            for i in range(100)
+        ])
+        await session.commit()
+        session.expunge_all()
+
+        count = await session.scalar(
+            select(func.count()).where(User.username.startswith(f"{prefix}_"))
+        )
+        assert count == 100
     
         # Force garbage collection
-        gc.collect()
-        await asyncio.sleep(0.1)  # Allow memory to be freed
+        await settle()
         
-        final_memory = get_process_memory()
+        final_memory = traced_memory_mb()
         memory_growth = final_memory - initial_memory
         
         # Allow for some memory overhead but fail if it's excessive
         assert memory_growth < 50, f"Excessive memory growth detected: {memory_growth}MB"
 
 @pytest.mark.asyncio
-async def test_connection_cleanup_under_error(test_db_session):
+async def test_connection_cleanup_under_error(test_db_session, traced_memory_mb):
     """Test connection cleanup when errors occur."""
-    initial_memory = get_process_memory()
+    initial_memory = traced_memory_mb()
     connection_count_start = 0
     ws_manager = MockConnectionManager()
     
@@ -206,8 +233,7 @@ async def test_connection_cleanup_under_error(test_db_session):
             del ws_manager.active_connections[thread_id][user_id]
             
         # Force cleanup
-        gc.collect()
-        await asyncio.sleep(0.1)
+        await settle()
         
         # Check DB connections
         connection_count_end = await count_db_connections(session)
@@ -220,15 +246,14 @@ async def test_connection_cleanup_under_error(test_db_session):
         assert active_connections == 5, "WebSocket connections leaked"
         
         # Check memory
-        final_memory = get_process_memory()
+        final_memory = traced_memory_mb()
         memory_growth = final_memory - initial_memory
         assert memory_growth < 10, f"Memory leaked: {memory_growth}MB growth"
 
 @pytest.mark.asyncio
-async def test_sustained_load(test_db_session):
+async def test_sustained_load(test_db_session, traced_memory_mb, uniq):
     """Test resource cleanup under sustained load."""
-    initial_memory = get_process_memory()
-    peak_memory = initial_memory
+    initial_memory = traced_memory_mb()
     memory_samples = []
     
     async with test_db_session as session:
@@ -238,40 +263,43 @@ async def test_sustained_load(test_db_session):
         # Create websocket manager
         ws_manager = MockConnectionManager()
         
+        now = datetime.now()
+
         # Run sustained load for 60 virtual users over 10 "cycles"
         for cycle in range(10):
-            # Create some DB load
-            for i in range(60):
-                user = User(
-                    username=f"user_{cycle}_{uuid.uuid4().hex}",
+            # Create some DB load; the batch flushes as one multi-row INSERT
+            session.add_all([
+                User(
+                    username=uniq(f"user_{cycle}"),
                     email=f"user_{cycle}_{i}@test.com",
                     hashed_password="test",
-                    created_at=datetime.now()
+                    created_at=now
                 )
-                session.add(user)
-                await session.commit()
+                for i in range(60)
+            ])
+            await session.commit()
             
-            # Create some websocket load
-            websockets = []
-            for i in range(60):
-                ws = MockWebSocket()
-                thread_id = uuid.uuid4()
-                user_id = uuid.uuid4()
-                await ws_manager.connect(ws, thread_id, user_id)
-                websockets.append((thread_id, user_id, ws))
+            # Create some websocket load, connecting every client at once
+            websockets = [
+                (uuid.uuid4(), uuid.uuid4(), MockWebSocket())
+                for i in range(60)
+            ]
+            await asyncio.gather(*(
+                ws_manager.connect(ws, thread_id, user_id)
+                for thread_id, user_id, ws in websockets
+            ))
             
             # Cleanup websockets
-            for thread_id, user_id, ws in websockets:
-                await ws_manager.disconnect(thread_id, user_id)
+            await asyncio.gather(*(
+                ws_manager.disconnect(thread_id, user_id)
+                for thread_id, user_id, ws in websockets
+            ))
             
             # Force GC
-            gc.collect()
-            await asyncio.sleep(0.1)
+            await settle()
             
             # Sample memory
-            current_memory = get_process_memory()
-            memory_samples.append(current_memory)
-            peak_memory = max(peak_memory, current_memory)
+            memory_samples.append(traced_memory_mb())
         
         # Final checks
         end_connections = await count_db_connections(session)
@@ -283,7 +311,7 @@ async def test_sustained_load(test_db_session):
         memory_variation = max(memory_samples) - min(memory_samples)
         assert memory_variation < 50, f"Memory usage unstable: {memory_variation}MB variation"
         
-        final_memory = get_process_memory()
+        final_memory = traced_memory_mb()
         memory_growth = final_memory - initial_memory
         assert memory_growth < 50, f"Memory leaked: {memory_growth}MB growth"
 
@@ -0,0 +1,52 @@
+import pytest
+from types import SimpleNamespace
+from models import ThreadAgent, AgentType
+from .conftest import test_db_session, EMAIL, HASHED_PASSWORD
+
+# routes pulls in agent_system, which needs openai and swarm
+routes = pytest.importorskip("routes")
+
+class StubAgentManager:
+    """Answers for every agent without calling an LLM."""
+    def __init__(self):
+        self.roles = []
+
+    async def get_response(self, role, message, thread_context):
+        self.roles.append(role)
+        return SimpleNamespace(
+            content=f"{role.value}: {message}",
+            metadata={"context": thread_context}
+        )
+
+@pytest.mark.asyncio
+async def test_send_message(test_db_session, db_manager, uniq, monkeypatch):
+    """Test that send_message stores the user's message and every agent reply."""
+    agent_manager = StubAgentManager()
+    monkeypatch.setattr(routes, "agent_manager", agent_manager)
+    async with test_db_session as session:
+        username = uniq("sender")
+        user = await db_manager.create_user(
+            session,
+            username=username,
+            email=EMAIL(username),
+            hashed_password=HASHED_PASSWORD
+        )
+        thread = await db_manager.create_thread(session, owner_id=user.id, title="Route Thread")
+        agents = [
+            ThreadAgent(thread_id=thread.id, agent_type=agent_type)
+            for agent_type in (AgentType.LAWYER, AgentType.ACCOUNTANT)
+        ]
+        session.add_all(agents)
+        await session.commit()
+
+        result = await routes.send_message(
+            thread.id,
+            "Hello",
+            db=session,
+            current_user=user
+        )
+
+        assert result["user_message"].content == "Hello"
+        assert set(agent_manager.roles) == {agent.agent_type for agent in agents}
+        assert {m.agent_id for m in result["agent_responses"]} == {agent.id for agent in agents}
+        assert all(m.message_metadata == {"context": "Hello"} for m in result["agent_responses"])
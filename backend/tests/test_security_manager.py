@@ -1,8 +1,4 @@
 import os
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent / "backend"))
-sys.path.append(str(Path(__file__).resolve().parent.parent))
 import json
 import pytest
 from fastapi import Request, HTTPException
@@ -10,7 +6,10 @@ from datetime import datetime, timedelta, UTC  # Added UTC import
 import jwt
 from unittest.mock import Mock
 import asyncio
+import time
+from collections import deque
 
+import security_manager as security_manager_module
 from security_manager import (
     SecurityManager, 
     RateLimitExceeded, 
@@ -46,6 +45,31 @@ async def test_rate_limit_basic(security_mgr, mock_request):
     with pytest.raises(RateLimitExceeded):
         await security_mgr.check_rate_limit(mock_request, "1/minute", 60)
 
+@pytest.mark.asyncio
+async def test_rate_limit_starlette_request(security_mgr):
+    request = Request({
+        "type": "http",
+        "client": ("10.1.2.3", 5000),
+        "path": "/scoped",
+        "headers": []
+    })
+
+    # Keyed by the client host and path from the ASGI scope
+    await security_mgr.check_rate_limit(request, "1/minute", 60)
+    assert ("10.1.2.3", "/scoped") in security_mgr.api_key_cache
+    with pytest.raises(RateLimitExceeded):
+        await security_mgr.check_rate_limit(request, "1/minute", 60)
+
+@pytest.mark.asyncio
+async def test_rate_limit_mock_request(security_mgr):
+    request = Mock()
+    request.client.host = "10.4.5.6"
+    request.url.path = "/mocked"
+
+    # No real ASGI scope, so the key comes from client.host and url.path
+    await security_mgr.check_rate_limit(request, "5/second", 1)
+    assert ("10.4.5.6", "/mocked") in security_mgr.api_key_cache
+
 @pytest.mark.asyncio
 async def test_rate_limit_different_paths(security_mgr):
     req1 = MockRequest(path="/path1")
@@ -65,6 +89,47 @@ async def test_rate_limit_expiration(security_mgr, mock_request):
     # Should succeed after expiration
     await security_mgr.check_rate_limit(mock_request, "10/minute", 1)
 
+@pytest.mark.asyncio
+async def test_rate_limit_cache_is_bounded(security_mgr, monkeypatch):
+    monkeypatch.setattr(security_manager_module, "RATE_LIMIT_CACHE_SIZE", 2)
+    first, second, third = (MockRequest(client_host=f"10.0.0.{i}") for i in range(3))
+    await security_mgr.check_rate_limit(first, "1/minute", 60)
+    await security_mgr.check_rate_limit(second, "1/minute", 60)
+    # A rejected request still counts as use
+    with pytest.raises(RateLimitExceeded):
+        await security_mgr.check_rate_limit(first, "1/minute", 60)
+    await security_mgr.check_rate_limit(third, "1/minute", 60)
+
+    # The least recently used client is the one evicted
+    assert list(security_mgr.api_key_cache) == [("10.0.0.0", "/test"), ("10.0.0.2", "/test")]
+
+@pytest.mark.asyncio
+async def test_rate_limit_cache_evicts_idle_keys_first(security_mgr, monkeypatch):
+    monkeypatch.setattr(security_manager_module, "RATE_LIMIT_CACHE_SIZE", 2)
+    live = MockRequest(client_host="10.0.0.1")
+    await security_mgr.check_rate_limit(live, "1/minute", 60)
+    # A more recently used key whose window has already passed
+    security_mgr.api_key_cache[("10.0.0.2", "/test")] = deque([time.monotonic() - 120])
+
+    await security_mgr.check_rate_limit(MockRequest(client_host="10.0.0.3"), "1/minute", 60)
+
+    assert list(security_mgr.api_key_cache) == [("10.0.0.1", "/test"), ("10.0.0.3", "/test")]
+
+@pytest.mark.asyncio
+async def test_rate_limit_survives_key_churn(security_mgr, monkeypatch):
+    monkeypatch.setattr(security_manager_module, "RATE_LIMIT_CACHE_SIZE", 10)
+    client = MockRequest(client_host="10.9.9.9", path="/threads/1")
+    await security_mgr.check_rate_limit(client, "1/minute", 60)
+
+    # Flooding distinct URLs can't flush a client that keeps sending requests
+    for i in range(50):
+        await security_mgr.check_rate_limit(
+            MockRequest(client_host="10.9.9.9", path=f"/threads/other-{i}"), "1/minute", 60
+        )
+        with pytest.raises(RateLimitExceeded):
+            await security_mgr.check_rate_limit(client, "1/minute", 60)
+    assert len(security_mgr.api_key_cache) == 10
+
 @pytest.mark.asyncio
 async def test_blocked_ip_basic(security_mgr, mock_request):
     # Record failed attempts to trigger blocking
@@ -78,7 +143,7 @@ async def test_blocked_ip_basic(security_mgr, mock_request):
 
 async def test_blocked_ip_expiration(security_mgr, mock_request):
     # Block IP with very short duration for testing
-    security_mgr.blocked_ips[mock_request.client.host] = datetime.now(UTC) + timedelta(seconds=1)
+    security_mgr.block_ip_for(mock_request.client.host, 1)
     
     # Verify initially blocked
     with pytest.raises(HTTPException):
@@ -141,43 +206,82 @@ async def test_jwt_bearer_expired_token():
     assert exc_info.value.status_code == 401
     assert "Token has expired" in str(exc_info.value.detail)
 
+@pytest.mark.asyncio
+async def test_jwt_bearer_caches_decoded_token(monkeypatch):
+    # Fixed key and algorithm, so the test doesn't depend on the environment
+    monkeypatch.setattr(security_manager_module, "JWT_SECRET_KEY", "cache-test-secret")
+    monkeypatch.setattr(security_manager_module, "JWT_ALGORITHM", "HS256")
+    payload = {
+        "sub": "user_id",
+        "exp": int((datetime.now(UTC) + timedelta(minutes=1)).timestamp())
+    }
+    token = jwt.encode(payload, "cache-test-secret", algorithm="HS256")
+    mock_request = Mock()
+    mock_request.headers = {"Authorization": f"Bearer {token}"}
+
+    decode_calls = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decode_calls.append(1)
+        return decode(*args, **kwargs)
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    # The bearer binds jwt.decode, the key and the algorithm when it is created
+    jwt_bearer = JWTBearer()
+
+    # Repeat requests with the same token reuse the first validation
+    for _ in range(3):
+        result = await jwt_bearer(mock_request)
+        assert result["sub"] == "user_id"
+        # Each caller gets its own copy of the cached payload
+        result["sub"] = "tampered"
+    assert len(decode_calls) == 1
+
+    # Invalid tokens are never cached
+    mock_request.headers = {"Authorization": "Bearer not-a-token"}
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            await jwt_bearer(mock_request)
+    assert len(decode_calls) == 3
+
 @pytest.mark.asyncio
 async def test_rate_limit_decorator():
     @rate_limit(limit="2/minute", duration=60)
     async def test_endpoint(request: Request):
         return {"message": "success"}
     
-    mock_request = MockRequest()
+    mock_request = MockRequest(path="/decorated")
     
     # First call should succeed
     result1 = await test_endpoint(request=mock_request)  # Note the named parameter
     assert result1["message"] == "success"
 
+    # The limit parsed at decoration time still applies
+    await test_endpoint(request=mock_request)
+    with pytest.raises(RateLimitExceeded):
+        await test_endpoint(request=mock_request)
+
 @pytest.mark.asyncio
 async def test_concurrent_requests(security_mgr):
     mock_requests = [MockRequest(client_host=f"192.168.1.{i}") for i in range(10)]
     
-    # Test concurrent rate limit checks
-    tasks = [
-        security_mgr.check_rate_limit(req, "10/minute", 60)
-        for req in mock_requests
-    ]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # All should succeed as they're from different IPs
-    assert all(not isinstance(r, Exception) for r in results)
+    # Test concurrent rate limit checks. All should succeed as they're from
+    # different IPs; any failure propagates out of the TaskGroup.
+    async with asyncio.TaskGroup() as tg:
+        for req in mock_requests:
+            tg.create_task(security_mgr.check_rate_limit(req, "10/minute", 60))
 
 async def test_cleanup(security_mgr):
     # Add some expired data
-    old_time = datetime.now(UTC) - timedelta(hours=1)
-    security_mgr.api_key_cache["test"] = [old_time]  # Now using a list of timestamps
+    old_time = time.monotonic() - 3600
+    security_mgr.api_key_cache[("192.168.1.1", "/test")] = deque([old_time])
     security_mgr.blocked_ips["192.168.1.1"] = old_time
     
     # Run cleanup
     await security_mgr.cleanup()
     
     # Verify expired data is removed
-    assert "test" not in security_mgr.api_key_cache
+    assert ("192.168.1.1", "/test") not in security_mgr.api_key_cache
     assert "192.168.1.1" not in security_mgr.blocked_ips
 
 @pytest.mark.asyncio
@@ -1,11 +1,6 @@
-import os
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).resolve().parent / "backend"))
-sys.path.append(str(Path(__file__).resolve().parent.parent))
-
-
 import pytest
+import asyncio
+import json
 from fastapi import WebSocket, WebSocketDisconnect
 from unittest.mock import AsyncMock, Mock
 from uuid import uuid4
@@ -46,13 +41,15 @@ async def test_remove_connection(connection_manager):
     mock_websocket = AsyncMock(spec=WebSocket)
 
     await connection_manager.connect(mock_websocket, thread_id, user_id)
-    await connection_manager.disconnect(user_id, thread_id)
+    await connection_manager.disconnect(thread_id, user_id)
 
     # Validate thread is removed if empty
     if thread_id in connection_manager.active_connections:
         assert user_id not in connection_manager.active_connections[thread_id]
     else:
         assert thread_id not in connection_manager.active_connections
+    assert (thread_id, user_id) not in connection_manager.connection_timestamps
+    assert user_id not in connection_manager.user_threads
 
 @pytest.mark.asyncio
 async def test_handle_websocket_disconnect(connection_manager):
@@ -64,9 +61,12 @@ async def test_handle_websocket_disconnect(connection_manager):
     await connection_manager.connect(mock_websocket, thread_id, user_id)
     
     # Simulate WebSocket disconnection
-    mock_websocket.receive.side_effect = WebSocketDisconnect
-    with pytest.raises(WebSocketDisconnect):
-        await mock_websocket.receive()
+    mock_websocket.receive_text.side_effect = WebSocketDisconnect
+    await connection_manager.handle_client_message(mock_websocket, thread_id, user_id)
+
+    assert not connection_manager.is_user_online(thread_id, user_id)
+    assert (thread_id, user_id) not in connection_manager.connection_timestamps
+    assert user_id not in connection_manager.user_threads
 
 @pytest.mark.asyncio
 async def test_typing_status_management(connection_manager):
@@ -79,6 +79,20 @@ async def test_typing_status_management(connection_manager):
     
     assert user_id in connection_manager.typing_status[thread_id]
 
+@pytest.mark.asyncio
+async def test_typing_status_debounced(connection_manager):
+    """Test that repeated typing events are coalesced but state changes are not."""
+    thread_id = uuid4()
+    typist_id = uuid4()
+    peer = AsyncMock(spec=WebSocket)
+    connection_manager.active_connections[thread_id] = {uuid4(): peer}
+
+    for is_typing in (True, True, True, False, False):
+        await connection_manager.update_typing_status(thread_id, typist_id, is_typing)
+
+    sent = [json.loads(call.args[0])["is_typing"] for call in peer.send_text.call_args_list]
+    assert sent == [True, False]
+
 @pytest.mark.asyncio
 async def test_connection_timestamps(connection_manager):
     """Test updating and checking connection timestamps."""
@@ -88,7 +102,93 @@ async def test_connection_timestamps(connection_manager):
 
     await connection_manager.connect(mock_websocket, thread_id, user_id)
 
-    # Match the key format used in ConnectionManager
-    timestamp_key = f"{thread_id}:{user_id}"
+    timestamp_key = (thread_id, user_id)
     assert timestamp_key in connection_manager.connection_timestamps
-    assert isinstance(connection_manager.connection_timestamps[timestamp_key], datetime)
+    assert isinstance(connection_manager.connection_timestamps[timestamp_key], float)
+
+@pytest.mark.asyncio
+async def test_expire_connections(connection_manager):
+    """Test that only connections past the timeout are disconnected."""
+    thread_id = uuid4()
+    stale_id, fresh_id = uuid4(), uuid4()
+    for user_id in (stale_id, fresh_id):
+        await connection_manager.connect(AsyncMock(spec=WebSocket), thread_id, user_id)
+    connection_manager.connection_timestamps[(thread_id, stale_id)] -= 120
+
+    await connection_manager._expire_connections(inactive_timeout=60)
+
+    assert list(connection_manager.connection_timestamps) == [(thread_id, fresh_id)]
+    assert connection_manager.get_active_users(thread_id) == [fresh_id]
+
+@pytest.mark.asyncio
+async def test_broadcast_concurrent(connection_manager):
+    """Test that broadcasts reach every peer concurrently and drop failures."""
+    thread_id = uuid4()
+    receiver_ids = [uuid4(), uuid4()]
+    failing_id = uuid4()
+    entered = [asyncio.Event(), asyncio.Event()]
+
+    def wait_for_peer(mine, peer):
+        async def send_text(message):
+            mine.set()
+            # Only completes if the other send is already in flight
+            await asyncio.wait_for(peer.wait(), timeout=1)
+        return send_text
+
+    receivers = []
+    for i, receiver_id in enumerate(receiver_ids):
+        ws = AsyncMock(spec=WebSocket)
+        connection_manager.active_connections.setdefault(thread_id, {})[receiver_id] = ws
+        ws.send_text.side_effect = wait_for_peer(entered[i], entered[1 - i])
+        receivers.append(ws)
+    failing_ws = AsyncMock(spec=WebSocket)
+    failing_ws.send_text.side_effect = RuntimeError("closed")
+    connection_manager.active_connections[thread_id][failing_id] = failing_ws
+
+    await connection_manager.broadcast(thread_id, {"type": "message"})
+
+    for ws in receivers:
+        ws.send_text.assert_called_once()
+        assert json.loads(ws.send_text.call_args.args[0]) == {"type": "message"}
+    assert set(connection_manager.active_connections[thread_id]) == set(receiver_ids)
+
+@pytest.mark.asyncio
+async def test_broadcast_bounded_concurrency(connection_manager):
+    """Test that a broadcast keeps at most the allowed sends in flight."""
+    thread_id = uuid4()
+    connection_manager._send_sem = asyncio.Semaphore(2)
+    in_flight = 0
+    peak = 0
+
+    async def send_text(message):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+
+    for _ in range(5):
+        ws = AsyncMock(spec=WebSocket)
+        ws.send_text.side_effect = send_text
+        connection_manager.active_connections.setdefault(thread_id, {})[uuid4()] = ws
+
+    await connection_manager.broadcast(thread_id, {"type": "message"})
+    assert peak == 2
+    assert len(connection_manager.active_connections[thread_id]) == 5
+
+@pytest.mark.asyncio
+async def test_broadcast_without_recipients(connection_manager, monkeypatch):
+    """Test that a broadcast nobody receives is never encoded."""
+    import websocket_manager
+    dumps = Mock(side_effect=json.dumps)
+    monkeypatch.setattr(websocket_manager, "_dumps", dumps)
+    thread_id = uuid4()
+    user_id = uuid4()
+    ws = AsyncMock(spec=WebSocket)
+    connection_manager.active_connections[thread_id] = {user_id: ws}
+
+    await connection_manager.broadcast(uuid4(), {"type": "message"})
+    await connection_manager.update_typing_status(thread_id, user_id, True)
+
+    dumps.assert_not_called()
+    ws.send_text.assert_not_called()
@@ -0,0 +1,86 @@
+import pytest
+import asyncio
+import uuid
+from unittest.mock import AsyncMock
+from fastapi import WebSocket
+
+class _DummyWS:
+    """Bare stand-in for tests that only store a WebSocket."""
+    __slots__ = ()
+
+    async def send_text(self, message: str):
+        pass
+
+@pytest.mark.asyncio
+async def test_websocket_management(db_manager):
+    """Test WebSocket connection management."""
+    thread_id = uuid.uuid4()
+    user_id = uuid.uuid4()
+    mock_websocket = _DummyWS()
+    
+    # Add connection
+    await db_manager.add_active_connection(thread_id, user_id, mock_websocket)
+    assert thread_id in db_manager._active_connections
+    assert user_id in db_manager._active_connections[thread_id]
+    
+    # Remove connection
+    await db_manager.remove_active_connection(thread_id, user_id)
+    assert thread_id not in db_manager._active_connections
+
+@pytest.mark.asyncio
+async def test_broadcast_to_thread(db_manager):
+    """Test thread message broadcasting."""
+    thread_id = uuid.uuid4()
+    sender_id = uuid.uuid4()
+    receiver_id = uuid.uuid4()
+    
+    # Create mock websockets
+    sender_ws = AsyncMock(spec=WebSocket)
+    receiver_ws = AsyncMock(spec=WebSocket)
+    
+    # Add connections
+    await db_manager.add_active_connection(thread_id, sender_id, sender_ws)
+    await db_manager.add_active_connection(thread_id, receiver_id, receiver_ws)
+    
+    # Test broadcast
+    message = "Test broadcast"
+    await db_manager.broadcast_to_thread(thread_id, sender_id, message)
+    
+    # Verify receiver got message but sender didn't
+    receiver_ws.send_text.assert_called_once_with(message)
+    sender_ws.send_text.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_broadcast_to_thread_concurrent(db_manager):
+    """Test that broadcasts are sent to all receivers concurrently."""
+    thread_id = uuid.uuid4()
+    sender_id = uuid.uuid4()
+    receiver_ids = [uuid.uuid4(), uuid.uuid4()]
+    entered = [asyncio.Event(), asyncio.Event()]
+
+    def wait_for_peer(mine, peer):
+        async def send_text(message):
+            mine.set()
+            # Only completes if the other send is already in flight
+            await asyncio.wait_for(peer.wait(), timeout=1)
+        return send_text
+
+    sender_ws = AsyncMock(spec=WebSocket)
+    await db_manager.add_active_connection(thread_id, sender_id, sender_ws)
+    receivers = []
+    for i, receiver_id in enumerate(receiver_ids):
+        ws = AsyncMock(spec=WebSocket)
+        ws.send_text.side_effect = wait_for_peer(entered[i], entered[1 - i])
+        await db_manager.add_active_connection(thread_id, receiver_id, ws)
+        receivers.append(ws)
+
+    await db_manager.broadcast_to_thread(thread_id, sender_id, "Test broadcast")
+
+    for ws in receivers:
+        ws.send_text.assert_called_once_with("Test broadcast")
+    sender_ws.send_text.assert_not_called()
+    # A sequential send would have timed out and dropped the receiver
+    assert all(
+        receiver_id in db_manager._active_connections[thread_id]
+        for receiver_id in receiver_ids
+    )
@@ -55,13 +55,14 @@ class MessageResponse(BaseModel):
     class Config:
         from_attributes = True
 
+WS_MESSAGE_TYPES = frozenset({'message', 'typing', 'read', 'join', 'leave'})
+
 class WebSocketMessage(BaseModel):
     type: str
     content: Dict
 
     @validator('type')
     def validate_message_type(cls, v):
-        allowed_types = {'message', 'typing', 'read', 'join', 'leave'}
-        if v not in allowed_types:
-            raise ValueError(f'Message type must be one of {allowed_types}')
-        return 
+        if v not in WS_MESSAGE_TYPES:
+            raise ValueError(f'Message type must be one of {sorted(WS_MESSAGE_TYPES)}')
+        return v
@@ -1,19 +1,45 @@
 from fastapi import WebSocket, WebSocketDisconnect, HTTPException
-from typing import Dict, Set, Optional, List
+from typing import Dict, Set, Optional, List, Tuple
+from collections import OrderedDict
 import json
 import asyncio
 import logging
+import os
+import time
 from datetime import datetime
 from uuid import UUID
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Seconds a single peer may take to accept a broadcast before it is dropped
+SEND_TIMEOUT = 5.0
+# Most sends in flight at once, so a huge thread can't flood the transport
+MAX_CONCURRENT_SENDS = int(os.getenv("WS_MAX_CONCURRENT_SENDS", "256"))
+# Seconds during which repeats of the same typing state are not re-broadcast
+TYPING_DEBOUNCE = 0.5
+
+if orjson is not None:
+    def _dumps(message: dict) -> str:
+        return orjson.dumps(message).decode()
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError
+    _loads = orjson.loads
+else:
+    _dumps = json.dumps
+    _loads = json.loads
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[UUID, Dict[UUID, WebSocket]] = {}
         self.user_threads: Dict[UUID, Set[UUID]] = {}
-        self.connection_timestamps: Dict[str, datetime] = {}
+        # Oldest connection first, so cleanup can stop at the first live one
+        self.connection_timestamps: OrderedDict[Tuple[UUID, UUID], float] = OrderedDict()
         self.typing_status: Dict[UUID, Dict[UUID, datetime]] = {}
+        self._typing_last_sent: Dict[Tuple[UUID, UUID], Tuple[float, bool]] = {}
+        self._send_sem = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
 
     async def connect(self, websocket: WebSocket, thread_id: UUID, user_id: UUID):
         """Connect and initialize a WebSocket connection."""
@@ -28,22 +54,32 @@ class ConnectionManager:
                 self.user_threads[user_id] = set()
             self.user_threads[user_id].add(thread_id)
             
-            connection_key = f"{thread_id}:{user_id}"
-            self.connection_timestamps[connection_key] = datetime.utcnow()
+            # Wall clock for the event, monotonic clock for idle expiry
+            joined_at = datetime.utcnow()
+            connection_key = (thread_id, user_id)
+            self.connection_timestamps[connection_key] = time.monotonic()
+            self.connection_timestamps.move_to_end(connection_key)
             
             # Broadcast user joined message
             await self.broadcast(thread_id, {
                 "type": "user_joined",
                 "user_id": str(user_id),
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": joined_at.isoformat()
             })
             
         except Exception as e:
             logger.error(f"Error connecting WebSocket: {e}")
             raise
 
-    async def disconnect(self, user_id: UUID, thread_id: UUID):
+    async def disconnect(self, thread_id: UUID, user_id: UUID):
         """Disconnect a user from a thread."""
+        self.connection_timestamps.pop((thread_id, user_id), None)
+        self._typing_last_sent.pop((thread_id, user_id), None)
+        threads = self.user_threads.get(user_id)
+        if threads is not None:
+            threads.discard(thread_id)
+            if not threads:
+                del self.user_threads[user_id]
         if thread_id in self.active_connections:
             if user_id in self.active_connections[thread_id]:
                 del self.active_connections[thread_id][user_id]
@@ -55,29 +91,46 @@ class ConnectionManager:
 
     async def broadcast(self, thread_id: UUID, message: dict, exclude_user: Optional[UUID] = None):
         """Broadcast message to all thread participants."""
-        if thread_id in self.active_connections:
-            message_json = json.dumps(message)
-            failed_connections = []
-            
-            for user_id, connection in self.active_connections[thread_id].items():
-                if user_id != exclude_user:
-                    try:
-                        await connection.send_text(message_json)
-                    except Exception as e:
-                        logger.error(f"Error broadcasting to user {user_id}: {e}")
-                        failed_connections.append(user_id)
-            
-            # Clean up failed connections
-            for user_id in failed_connections:
+        connections = self.active_connections.get(thread_id)
+        if not connections:
+            return
+        if exclude_user in connections:
+            recipients = [
+                (user_id, connection)
+                for user_id, connection in connections.items()
+                if user_id != exclude_user
+            ]
+        else:
+            recipients = list(connections.items())
+        if not recipients:
+            # Nobody to tell (e.g. typing alone), so skip encoding entirely
+            return
+        message_json = _dumps(message)
+        
+        # Send to everyone concurrently so one slow peer can't hold up the rest
+        results = await asyncio.gather(
+            *(self._send(connection, message_json) for _, connection in recipients),
+            return_exceptions=True
+        )
+        
+        # Clean up failed connections
+        for (user_id, _), result in zip(recipients, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error broadcasting to user {user_id}: {result}")
                 await self.disconnect(thread_id, user_id)
 
+    async def _send(self, connection: WebSocket, message_json: str):
+        """Send one message, waiting for a free send slot first."""
+        async with self._send_sem:
+            await asyncio.wait_for(connection.send_text(message_json), SEND_TIMEOUT)
+
     async def send_personal_message(self, message: dict, thread_id: UUID, user_id: UUID):
         """Send a message to a specific user in a thread."""
         if (thread_id in self.active_connections and 
             user_id in self.active_connections[thread_id]):
             try:
                 connection = self.active_connections[thread_id][user_id]
-                await connection.send_text(json.dumps(message))
+                await connection.send_text(_dumps(message))
             except Exception as e:
                 logger.error(f"Error sending personal message to user {user_id}: {e}")
                 await self.disconnect(thread_id, user_id)
@@ -93,6 +146,14 @@ class ConnectionManager:
             self.typing_status[thread_id][user_id] = current_time
         else:
             self.typing_status[thread_id].pop(user_id, None)
+        
+        # Coalesce keystroke bursts; a change of state always goes out
+        key = (thread_id, user_id)
+        now = time.monotonic()
+        last = self._typing_last_sent.get(key)
+        if last is not None and last[1] == is_typing and now - last[0] < TYPING_DEBOUNCE:
+            return
+        self._typing_last_sent[key] = (now, is_typing)
             
         await self.broadcast(
             thread_id,
@@ -116,11 +177,13 @@ class ConnectionManager:
 
     async def handle_client_message(self, websocket: WebSocket, thread_id: UUID, user_id: UUID):
         """Handle incoming messages from clients."""
+        # Formatted once for every event this connection sends
+        user_id_str = str(user_id)
         try:
             while True:
                 message = await websocket.receive_text()
                 try:
-                    data = json.loads(message)
+                    data = _loads(message)
                     message_type = data.get("type")
                     
                     if message_type == "message":
@@ -129,7 +192,7 @@ class ConnectionManager:
                             thread_id,
                             {
                                 "type": "message",
-                                "user_id": str(user_id),
+                                "user_id": user_id_str,
                                 "content": data.get("content"),
                                 "timestamp": datetime.utcnow().isoformat()
                             }
@@ -147,7 +210,7 @@ class ConnectionManager:
                             thread_id,
                             {
                                 "type": "read",
-                                "user_id": str(user_id),
+                                "user_id": user_id_str,
                                 "message_id": data.get("message_id"),
                                 "timestamp": datetime.utcnow().isoformat()
                             }
@@ -163,28 +226,28 @@ class ConnectionManager:
             logger.error(f"Error handling client message: {e}")
             await self.disconnect(thread_id, user_id)
 
+    async def _expire_connections(self, inactive_timeout: int):
+        """Disconnect every connection older than the timeout."""
+        cutoff = time.monotonic() - inactive_timeout
+        while self.connection_timestamps:
+            (thread_id, user_id), timestamp = next(iter(self.connection_timestamps.items()))
+            if timestamp >= cutoff:
+                break
+            self.connection_timestamps.popitem(last=False)
+            await self.disconnect(thread_id, user_id)
+
     async def cleanup_inactive_connections(self, inactive_timeout: int = 3600):
         """Cleanup inactive connections periodically."""
         while True:
             try:
-                current_time = datetime.utcnow()
-                connections_to_remove = []
-                
-                for connection_key, timestamp in self.connection_timestamps.items():
-                    if (current_time - timestamp).total_seconds() > inactive_timeout:
-                        thread_id, user_id = connection_key.split(":")
-                        connections_to_remove.append((
-                            UUID(thread_id),
-                            UUID(user_id)
-                        ))
-                
-                for thread_id, user_id in connections_to_remove:
-                    await self.disconnect(thread_id, user_id)
+                await self._expire_connections(inactive_timeout)
                     
                 # Clean up empty typing statuses
-                for thread_id in list(self.typing_status.keys()):
-                    if not self.typing_status[thread_id]:
-                        del self.typing_status[thread_id]
+                self.typing_status = {
+                    thread_id: statuses
+                    for thread_id, statuses in self.typing_status.items()
+                    if statuses
+                }
                     
             except Exception as e:
                 logger.error(f"Error in cleanup task: {e}")